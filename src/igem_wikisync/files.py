@@ -1,77 +1,136 @@
 import hashlib
+import os
+from functools import lru_cache
 from pathlib import Path
 
+try:
+    from functools import cached_property
+except ImportError:  # Python < 3.8
+    class cached_property:
+        '''
+            Minimal replacement for functools.cached_property.
+            Computes the value on first access and stores it on the instance.
+        '''
+
+        def __init__(self, func):
+            self.func = func
+            self.__doc__ = func.__doc__
+
+        def __get__(self, instance, owner=None):
+            if instance is None:
+                return self
+            value = instance.__dict__[self.func.__name__] = self.func(instance)
+            return value
+
+
+@lru_cache(maxsize=None)
+def url_prefixes(year):
+    '''
+        Returns the base URL of the iGEM wiki for the given year,
+        and the prefix of its index.php URLs. Computed once per year.
+    '''
+    wiki_base = f'https://{year}.igem.org/'
+    return wiki_base, wiki_base + 'wiki/index.php?title='
+
+
+@lru_cache(maxsize=None)
+def upload_prefix(team, poster_mode):
+    '''
+        Returns the prefix that iGEM filenames of assets start with.
+        Computed once per team.
+    '''
+    if poster_mode:
+        return f'T--{team}--Poster_'
+    return f'T--{team}--'
+
+
+def hash_file(algorithm, path):
+    '''
+        Returns the hex digest of a file, computed using
+        the given hashlib algorithm.
+    '''
+
+    # open file for reading in binary mode
+    with open(path, 'rb') as file:
+
+        # let hashlib read the file in C if possible (Python 3.11+)
+        if hasattr(hashlib, 'file_digest'):
+            return hashlib.file_digest(file, algorithm).hexdigest()
+
+        # otherwise read 1 MiB at a time into a reusable buffer
+        h = hashlib.new(algorithm)
+        buffer = memoryview(bytearray(1 << 20))
+        size = file.readinto(buffer)
+        while size:
+            h.update(buffer[:size])
+            size = file.readinto(buffer)
+
+    # return the hex representation of digest
+    return h.hexdigest()
+
 
 class BaseFile:
     '''Base class for all file objects. Not to be used directly.
     Use HTMLfile, CSSfile, JSfile or OtherFile instead.
     '''
 
-    # pylint: disable=too-many-instance-attributes
-    # Eight is reasonable in this case.
-
     def __init__(self, path, config):
         self._config = config
 
         self._path = Path(path)
+        self._team = config['team']
+        self._wiki_base, self._index_prefix = url_prefixes(config['year'])
 
-        self._stem = str(self._path.stem)
-        self._extension = str(self._path.suffix[1:]).lower()
-        self._filename = str(self._stem + '.' + self._extension)
-        self._parent = self._path.parent
-        self._src_path = self._config['src_dir'] / self._path
-        self._build_path = self._config['build_dir'] / self._path
-        self._upload_URL = None  # URL of the upload form for file
-        self._link_URL = None   # URL where the file will live
+        # everything else is derived from the path when it is first used,
+        # since most files don't change and never need their URLs
 
     @property
     def path(self):
         ''' Path of the file relative to src_dir. '''
         return self._path
 
-    @property
+    @cached_property
     def filename(self):
         ''' Filename with extension. '''
-        return self._filename
+        return f'{self._path.stem}.{self.extension}'
 
-    @property
+    @cached_property
     def extension(self):
         ''' File extension. '''
-        return self._extension
-
-    # @property
-    # def parent(self):
-    #     ''' Path without the filename and terminal /. '''
-    #     return self._parent
+        return self._path.suffix[1:].lower()
 
-    @property
+    @cached_property
     def src_path(self):
         ''' Build path with src_dir. (src_dir/..)'''
-        return self._src_path
+        return self._config['src_dir'] / self._path
 
-    @property
+    @cached_property
     def build_path(self):
         ''' Build path with build_dir (build_dir/..). '''
-        return self._build_path
+        return self._config['build_dir'] / self._path
 
-    @property
+    @cached_property
     def upload_URL(self):
         ''' URL of the upload form for this file. '''
-        return self._upload_URL
+        return self._generate_upload_URL()
 
-    @property
+    @cached_property
     def link_URL(self):
         ''' URL which can be used to link to this file. '''
-        return self._link_URL
+        return self._generate_link_URL()
 
-    @property
+    @cached_property
     def raw_URL(self):
         ''' URL where raw content can be found.
         Same as link_URL for JS and CSS.
         For HTML files, raw page content will be found,
         without wrapper iGEM HTML.
         '''
-        return self._raw_URL
+        return self._generate_raw_URL()
+
+    @cached_property
+    def _upload_path(self):
+        return self._generate_upload_path()
 
 
 class HTMLfile(BaseFile):
@@ -81,13 +140,6 @@ class HTMLfile(BaseFile):
     :type path: str or :class:`pathlib.Path`
     '''
 
-    def __init__(self, path, config):
-        BaseFile.__init__(self, path, config)
-        self._upload_path = self._generate_upload_path()
-        self._upload_URL = self._generate_upload_URL()
-        self._link_URL = self._generate_link_URL()
-        self._raw_URL = self._generate_raw_URL()
-
     def _generate_upload_path(self):
         '''
             Returns upload path, which is the part of the URL after team name
@@ -95,60 +147,49 @@ class HTMLfile(BaseFile):
         '''
 
         # remove /index.html
+        # as_posix() gives forward slashes on every platform
         if 'index.html' in str(self.path):
-            upload_path = str(self.path.parent)
+            upload_path = self.path.parent.as_posix()
         else:
-            upload_path = str(self.path.parent / self.path.stem)
+            upload_path = (self.path.parent / self.path.stem).as_posix()
 
         if upload_path == '.':
             return ''
         else:
-            return '/' + upload_path.replace('\\', '/')
+            return '/' + upload_path
 
     def _generate_upload_URL(self):
         '''
             Returns the URL of the iGEM page where this file can be uploaded.
             Private function. Use upload_URL to access instead.
         '''
-        return 'https://' + self._config['year'] + '.igem.org/wiki/index.php?title=Team:' + \
-            self._config['team'] + self._upload_path + '&action=edit'
+        return f'{self._index_prefix}Team:{self._team}{self._upload_path}&action=edit'
 
     def _generate_link_URL(self):
         '''
             Returns the iGEM URL where this page will be found and can be linked to.
             Private function. Use link_URL to access instead.
         '''
-        return 'https://' + self._config['year'] + '.igem.org/Team:' + self._config['team'] + \
-            self._upload_path
+        return f'{self._wiki_base}Team:{self._team}{self._upload_path}'
 
     def _generate_raw_URL(self):
         '''
             Returns the iGEM URL where this page will be found and can be linked to.
             Private function. Use link_URL to access instead.
         '''
-        return 'https://' + self._config['year'] + '.igem.org/wiki/index.php?title=Team:' + \
-            self._config['team'] + self._upload_path + '&action=raw'
+        return f'{self._index_prefix}Team:{self._team}{self._upload_path}&action=raw'
 
 
 class CSSfile(BaseFile):
-    def __init__(self, path, config):
-        BaseFile.__init__(self, path, config)
-        self._upload_path = self._generate_upload_path()
-        self._upload_URL = self._generate_upload_URL()
-        self._link_URL = self._generate_link_URL()
-        self._raw_URL = self._link_URL
-
     def _generate_upload_path(self):
         '''
             Returns upload path, which is the part of the URL after team name
             but before & and ?. Includes / if required.
         '''
         # remove file extension
-        upload_path = self.path.parent / self.path.stem
+        upload_path = (self.path.parent / self.path.stem).as_posix()
         # add 'CSS'
-        upload_path = str(upload_path).replace('.', '-') + 'CSS'
-
-        return '/' + upload_path.replace('\\', '/')
+        return '/' + upload_path.replace('.', '-') + 'CSS'
 
     def _generate_upload_URL(self):
         '''
@@ -156,59 +197,69 @@ class CSSfile(BaseFile):
             Private function. Use upload_URL to access instead.
         '''
 
-        return 'https://' + self._config['year'] + '.igem.org/wiki/index.php?title=Template:' + self._config['team'] + \
-            self._upload_path.replace('\\', '/') + '&action=edit'
+        return f'{self._index_prefix}Template:{self._team}{self._upload_path}&action=edit'
 
     def _generate_link_URL(self):
         '''
             Returns the iGEM URL where this page will be found and can be linked to.
         '''
-        return 'https://' + self._config['year'] + '.igem.org/Template:' + self._config['team'] + \
-            self._upload_path + '?action=raw&ctype=text/css'
+        return f'{self._wiki_base}Template:{self._team}{self._upload_path}?action=raw&ctype=text/css'
 
+    def _generate_raw_URL(self):
+        '''
+            Returns the iGEM URL where raw content can be found.
+            Same as link_URL.
+        '''
+        return self.link_URL
 
-class JSfile(BaseFile):
-    def __init__(self, path, config):
-        BaseFile.__init__(self, path, config)
-        self._upload_path = self._generate_upload_path()
-        self._upload_URL = self._generate_upload_URL()
-        self._link_URL = self._generate_link_URL()
-        self._raw_URL = self._link_URL
 
+class JSfile(BaseFile):
     def _generate_upload_path(self):
         '''
             Returns upload path, which is the part of the URL after team name
             but before & and all. Includes / if required.
         '''
         # remove file extension
-        upload_path = self.path.parent / self.path.stem
+        upload_path = (self.path.parent / self.path.stem).as_posix()
         # add 'JS'
-        upload_path = str(upload_path).replace('.', '-') + 'JS'
-
-        return '/' + upload_path.replace('\\', '/')
+        return '/' + upload_path.replace('.', '-') + 'JS'
 
     def _generate_upload_URL(self):
         '''
             Returns the URL of the iGEM page where this file can be uploaded.
             Private function. Use upload_URL to access instead.
         '''
-        return 'https://' + self._config['year'] + '.igem.org/wiki/index.php?title=Template:' + self._config['team'] + \
-            self._upload_path + '&action=edit'
+        return f'{self._index_prefix}Template:{self._team}{self._upload_path}&action=edit'
 
     def _generate_link_URL(self):
         '''
             Returns the iGEM URL where this page will be found and can be linked to.
         '''
-        return 'https://' + self._config['year'] + '.igem.org/Template:' + self._config['team'] + \
-            self._upload_path + '?action=raw&ctype=text/javascript'
+        return f'{self._wiki_base}Template:{self._team}{self._upload_path}?action=raw&ctype=text/javascript'
+
+    def _generate_raw_URL(self):
+        '''
+            Returns the iGEM URL where raw content can be found.
+            Same as link_URL.
+        '''
+        return self.link_URL
 
 
 class OtherFile(BaseFile):
-    def __init__(self, path, config):
+    def __init__(self, path, config, stat=None):
         BaseFile.__init__(self, path, config)
-        self._upload_URL = 'https://' + self._config['year'] + '.igem.org/Special:Upload'
+        self._link_URL = None  # assigned by iGEM when the file is uploaded
         self._upload_filename = self._generate_upload_filename()
-        self._md5_hash = self._generate_md5_hash()
+        # stat is cheap compared to hashing, and can be passed in
+        # if it was already obtained while looking for files
+        self._stat = stat if stat is not None else os.stat(self.src_path)
+        # computed when required, or set by hashing several files together
+        self._md5_hash = None
+
+    @property
+    def link_URL(self):
+        ''' URL which can be used to link to this file. '''
+        return self._link_URL
 
     @property
     def upload_filename(self):
@@ -223,40 +274,42 @@ class OtherFile(BaseFile):
     @property
     def md5_hash(self):
         ''' MD5 hash of the file. '''
+        if self._md5_hash is None:
+            self.compute_hash()
         return self._md5_hash
 
+    @property
+    def mtime_ns(self):
+        ''' Modification time of the file in nanoseconds. '''
+        return self._stat.st_mtime_ns
+
+    @property
+    def size(self):
+        ''' Size of the file in bytes. '''
+        return self._stat.st_size
+
+    def _generate_upload_URL(self):
+        '''
+            Returns the URL of the iGEM upload form.
+            Private function. Use upload_URL to access instead.
+        '''
+        return f'{self._wiki_base}Special:Upload'
+
     def _generate_upload_filename(self):
         if self.filename[:3] != 'T--':
-            if self._config['poster_mode']:
-                return 'T--' + self._config['team'] + '--Poster_' + '--'.join(self.path.parts[1:])
-            else:
-                return 'T--' + self._config['team'] + '--' + '--'.join(self.path.parts[1:])
+            prefix = upload_prefix(self._team, self._config['poster_mode'])
+            return f"{prefix}{'--'.join(self.path.parts[1:])}"
         else:
             return self.filename
 
-    def _generate_md5_hash(self):
+    def compute_hash(self):
         '''
-            Returns the MD5 hash of the file
+            Computes and stores the MD5 hash of the file
         '''
+        self._md5_hash = hash_file('md5', self.src_path)
 
-        # import os
-        # return os.getcwd()
-
-        # make a hash object
-        h = hashlib.md5()
-
-        # open file for reading in binary mode
-        with open(self.src_path, 'rb') as file:
-
-            # loop till the end of the file
-            chunk = 0
-            while chunk != b'':
-                # read only 1024 bytes at a time
-                chunk = file.read(1024)
-                h.update(chunk)
-
-        # return the hex representation of digest
-        return h.hexdigest()
+    def set_md5_hash(self, md5_hash):
+        self._md5_hash = md5_hash
 
     def set_link_URL(self, url):
         self._link_URL = url
@@ -28,7 +28,9 @@ console_handler.setLevel(logging.WARNING)
 logger.addHandler(console_handler)
 
 # Create file logger
-file_handler = logging.FileHandler('wikisync.log', mode='w')
+# The file is only opened once something is logged, so that
+# worker processes importing this module don't truncate it
+file_handler = logging.FileHandler('wikisync.log', mode='w', delay=True)
 file_format = logging.Formatter('%(asctime)s : %(levelname)s : %(funcName)s : %(message)s')
 file_handler.setFormatter(file_format)
 file_handler.setLevel(logging.DEBUG)
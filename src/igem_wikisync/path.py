@@ -1,9 +1,10 @@
 import os
 import re
+from functools import lru_cache
 from pathlib import Path
 
-from igem_wikisync.files import CSSfile, HTMLfile, JSfile
-from igem_wikisync.logger import logger
+from igem_wikisync.files import CSSfile, HTMLfile, JSfile, url_prefixes
+from igem_wikisync.logger import console_handler, logger
 
 
 def is_relative(url: str) -> bool:
@@ -20,6 +21,15 @@ def is_relative(url: str) -> bool:
     return not absolute and not hashtag
 
 
+@lru_cache(maxsize=None)
+def _resolve_src_dir(src_dir) -> Path:
+    """
+        Returns the absolute path of src_dir.
+        Computed once per src_dir instead of once per URL.
+    """
+    return Path(src_dir).resolve()
+
+
 def resolve_relative_path(path: str, parent: Path, src_dir: str) -> Path:
     """
     Resolves a given relative path to it's absolute local counterpart.
@@ -39,7 +49,7 @@ def resolve_relative_path(path: str, parent: Path, src_dir: str) -> Path:
 
     # TODO: Understand and comment this function.
 
-    src_dir = Path(src_dir).resolve()
+    src_dir = _resolve_src_dir(src_dir)
 
     # remove trailing / or \
     if path[-1] == '/' or path[-1] == '\\':
@@ -74,7 +84,7 @@ def iGEM_URL(config: dict, path: Path, upload_map: dict, url: str) -> str:
     """
 
     if config['silence_warnings']:
-        logger.handlers[0].setLevel(40)
+        console_handler.setLevel(40)
 
     # Store input for logging and/or returning
     old_path = url
@@ -87,16 +97,19 @@ def iGEM_URL(config: dict, path: Path, upload_map: dict, url: str) -> str:
         return url
 
     if url == '/':
-        return 'https://' + config['year'] + '.igem.org/Team:' + config['team']
+        wiki_base, _ = url_prefixes(config['year'])
+        return f"{wiki_base}Team:{config['team']}"
 
     # Resolve relative path to local absolute path
     resolved_path = resolve_relative_path(url, path.parent, config['src_dir'])
 
     # check upload_map
     found = False
-    for filetype in upload_map.keys():
-        if str(resolved_path) in upload_map[filetype].keys():
-            url = upload_map[filetype][str(resolved_path)]['link_URL']
+    resolved_path_str = str(resolved_path)
+    for files in upload_map.values():
+        entry = files.get(resolved_path_str)
+        if entry is not None:
+            url = entry['link_URL']
             found = True
             break
 
@@ -1,28 +1,88 @@
+import hashlib
+import json
+import multiprocessing
 import os
+import queue
 import shutil
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from datetime import date
-from hashlib import md5
+from functools import partial
 from http.cookiejar import LWPCookieJar
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 
 import mechanicalsoup
 import yaml
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from igem_wikisync.browser import iGEM_login, iGEM_upload_file, iGEM_upload_page
-from igem_wikisync.files import CSSfile, HTMLfile, JSfile, OtherFile
-from igem_wikisync.logger import logger
+from igem_wikisync.files import CSSfile, HTMLfile, JSfile, OtherFile, hash_file
+from igem_wikisync.logger import console_handler, logger
 from igem_wikisync.parsers import CSSparser, HTMLparser, JSparser
 
+# use the LibYAML bindings if PyYAML was built with them
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+# orjson is optional, but much faster than json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # pylint: disable=too-many-instance-attributes, fixme
 
+# MD5 is only used to detect changes, so OpenSSL doesn't
+# need to check whether it is allowed (Python 3.9+)
+if sys.version_info >= (3, 9):
+    md5 = partial(hashlib.md5, usedforsecurity=False)
+else:
+    md5 = hashlib.md5
+
+# processed code files are stored here between runs
+BUILD_CACHE_DIR = '.wikisync_cache'
+
+# upload map fields that only make sense on this machine, such as
+# modification times. They are stored in the build cache directory instead
+# of upload_map.json, which is shared through version control
+LOCAL_FIELDS = ('mtime_ns', 'size', 'src_mtime_ns', 'assets_signature')
+LOCAL_UPLOAD_MAP = os.path.join(BUILD_CACHE_DIR, 'upload_map.local.json')
+
+# file object to create for each supported extension
+_EXT_CLASS = {
+    'html': HTMLfile,
+    'css': CSSfile,
+    'js': JSfile,
+}
+_EXT_CLASS.update(dict.fromkeys(['png', 'gif', 'jpg', 'jpeg', 'pdf', 'ppt', 'txt',
+                                 'zip', 'mp3', 'mp4', 'webm', 'mov', 'swf', 'xls',
+                                 'xlsx', 'docx', 'pptx', 'csv', 'm', 'ogg', 'gb',
+                                 'tif', 'tiff', 'fcs', 'otf', 'eot', 'ttf', 'woff', 'svg'], OtherFile))
+
+# where file objects of each class are stored in the file cache
+_CACHE_KEY = {
+    HTMLfile: 'html',
+    CSSfile: 'css',
+    JSfile: 'js',
+    OtherFile: 'other',
+}
+
 
 def run(team: str,
         src_dir: str,
         build_dir: str,
         year=date.today().year,
         silence_warnings=False,
-        poster_mode=False):
+        poster_mode=False,
+        concurrency=8):
     '''
     Runs iGEM-WikiSync and uploads all files to iGEM servers
     while replacing relative URLs with those on the iGEM server.
@@ -39,6 +99,7 @@ def run(team: str,
             * Renames files to T--[TeamName]--Poster_[filename].extension
             * Adds the poster template the HTML file
             * Fails if any other HTML/CSS/JS file is provided
+        concurrency: Number of files uploaded simultaneously. 8 by default.
 
     Returns:
         1: Incorrect input in function call.
@@ -70,21 +131,32 @@ def run(team: str,
         logger.critical('silence_warnings must have a boolean value.')
         sys.exit(1)
 
+    if not isinstance(concurrency, int) or concurrency < 1:
+        logger.critical('concurrency must be a positive integer.')
+        sys.exit(1)
+
+    # broken link warnings are logged while parsing, possibly in
+    # worker processes, so they are silenced here for the whole run
+    if silence_warnings:
+        console_handler.setLevel(40)
+
+    # converted once, so that file objects can join paths directly
     config = {
         'team':      team,
-        'src_dir':   src_dir,
-        'build_dir': build_dir,
+        'src_dir':   Path(src_dir),
+        'build_dir': Path(build_dir),
         'year': str(year),
         'silence_warnings': silence_warnings,
-        'poster_mode': poster_mode
+        'poster_mode': poster_mode,
+        'concurrency': concurrency
     }
 
     # * 2. Load or create upload_map
     upload_map = get_upload_map()
 
     # * 3. Create build directory
-    if not os.path.isdir(build_dir):
-        os.mkdir(build_dir)
+    if not os.path.isdir(config['build_dir']):
+        os.mkdir(config['build_dir'])
         # ? error handling here?
 
     # * 4. Get iGEM credentials from environment variables
@@ -94,7 +166,7 @@ def run(team: str,
     }
 
     # * 5. Load/create cookie file
-    browser, cookiejar = get_browser_with_cookies()
+    browser, cookiejar = get_browser_with_cookies(concurrency)
 
     # * 6. Login to iGEM
     login = iGEM_login(browser, credentials, config)
@@ -107,54 +179,49 @@ def run(team: str,
     # # TODO: check if this works, might not
     # cookiejar.save()
 
-    # * 8. Cache files
-    files = cache_files(upload_map, config)
+    # upload map is saved every few uploads while uploading,
+    # and once more at the end, even if the run fails or is interrupted
+    map_writer = UploadMapWriter(upload_map)
+    try:
+        # * 8. Cache files
+        files = cache_files(upload_map, config)
+
+        # * 9. Upload all assets and create a map
+        uploaded_assets = upload_and_write_assets(files['other'], browser, upload_map, config, map_writer)
 
-    # * 9. Upload all assets and create a map
-    uploaded_assets = upload_and_write_assets(files['other'], browser, upload_map, config)
+        # * 10. Build files and upload changed files
+        uploaded_code = build_and_upload(files, browser, config, upload_map, map_writer)
 
-    # * 10. write upload map just in case
-    # things go wrong while dealing with code
-    write_upload_map(upload_map)
+    except SystemExit:
+        # the upload map has been saved before exiting
+        raise
 
-    # * 11. Build files and upload changed files
-    uploaded_code = build_and_upload(files, browser, config, upload_map)
+    except BaseException:
+        map_writer.write()
+        raise
 
-    # * 12. Write final upload map
-    write_upload_map(upload_map)
+    # * 11. Write final upload map
+    map_writer.write()
 
     print_summary(uploaded_assets, uploaded_code)
 
 
 def get_upload_map():
     """
-    Opens existing upload_map.yml or creates and empty upload map.
+    Opens existing upload_map.json or creates and empty upload map.
+    upload_map.yml, used by older versions, is read if there is
+    no upload_map.json. It is replaced by upload_map.json on the next write.
 
     Upload map is a dictionary that contains previously uploaded
     html, css, js and other files, along with their URLs and hashes.
     """
 
-    if os.path.isfile('upload_map.yml'):
-        try:
-            with open('upload_map.yml', 'r') as file:
-                upload_map = yaml.safe_load(file)
-        except Exception:
-            logger.critical('upload_map.yml exists but could not be opened. Please try again.')
-            sys.exit(3)
-
-        if isinstance(upload_map, type(None)):
-            upload_map = {}
-
-        # make sure upload map has all the keys
-        for key in ['assets', 'html', 'css', 'js']:
-            if key not in upload_map.keys() or isinstance(upload_map[key], type(None)):
-                upload_map[key] = {}
-            elif not isinstance(upload_map[key], dict):
-                logger.critical('upload_map.yml has an invalid format.')
-                logger.critical('Please fix/delete the file and run the program again.')
-                sys.exit(3)
-
-        return upload_map
+    if os.path.isfile('upload_map.json'):
+        filename = 'upload_map.json'
+        load = load_json
+    elif os.path.isfile('upload_map.yml'):
+        filename = 'upload_map.yml'
+        load = load_yaml
     else:
         return {
             'assets': {},
@@ -163,26 +230,203 @@ def get_upload_map():
             'js': {}
         }
 
+    try:
+        upload_map = load(filename)
+    except Exception:
+        logger.critical(f'{filename} exists but could not be opened. Please try again.')
+        sys.exit(3)
+
+    if isinstance(upload_map, type(None)):
+        upload_map = {}
+    elif not isinstance(upload_map, dict):
+        logger.critical(f'{filename} has an invalid format.')
+        logger.critical('Please fix/delete the file and run the program again.')
+        sys.exit(3)
+
+    # make sure upload map has all the keys
+    for key in ['assets', 'html', 'css', 'js']:
+        if key not in upload_map or isinstance(upload_map[key], type(None)):
+            upload_map[key] = {}
+        elif not isinstance(upload_map[key], dict):
+            logger.critical(f'{filename} has an invalid format.')
+            logger.critical('Please fix/delete the file and run the program again.')
+            sys.exit(3)
 
-def write_upload_map(upload_map: dict, filename='upload_map.yml'):
-    """ Writes upload map to file. """
+    merge_local_fields(upload_map)
+
+    return upload_map
+
+
+def merge_local_fields(upload_map, filename=LOCAL_UPLOAD_MAP):
+    """
+    Adds the fields stored by split_local_fields() back to upload_map.
+    Fields of an entry are only used if its MD5 hash hasn't changed,
+    for example because someone else uploaded a new version of the file.
+
+    Arguments:
+        upload_map: custom upload map
+        filename: file where the local fields are stored
+    """
 
     try:
-        with open(filename, 'w') as file:
-            yaml.dump(upload_map, file, sort_keys=True)
+        local = load_json(filename) or {}
+    except Exception:
+        logger.debug(f'Could not read {filename}.', exc_info=True)
+        return
+
+    for section, entries in local.items():
+        for path, fields in entries.items():
+            entry = upload_map.get(section, {}).get(path)
+            if isinstance(entry, dict) and entry.get('md5') == fields.get('md5'):
+                entry.update((key, fields[key]) for key in LOCAL_FIELDS if key in fields)
+
+
+def split_local_fields(upload_map):
+    """
+    Separates the fields that only make sense on this machine
+    from the ones that are shared through upload_map.json.
+
+    Arguments:
+        upload_map: custom upload map
+
+    Returns:
+        shared: upload map without the local fields
+        local: local fields of each entry, along with its MD5 hash
+    """
+
+    shared = {}
+    local = {}
+
+    for section, entries in upload_map.items():
+        shared[section] = {}
+        for path, entry in entries.items():
+            shared[section][path] = {key: value for key, value in entry.items() if key not in LOCAL_FIELDS}
+            fields = {key: entry[key] for key in LOCAL_FIELDS if key in entry}
+            if fields:
+                fields['md5'] = entry.get('md5')
+                local.setdefault(section, {})[path] = fields
+
+    return shared, local
+
+
+def write_upload_map(upload_map: dict, filename='upload_map.json', local_filename=LOCAL_UPLOAD_MAP):
+    """
+    Writes upload map to file.
+    Fields that only make sense on this machine are written to local_filename.
+    """
+
+    shared, local = split_local_fields(upload_map)
+
+    # indented, so that changes can be reviewed with version control
+    try:
+        if orjson is not None:
+            contents = orjson.dumps(shared, option=orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2)
+        else:
+            contents = json.dumps(shared, sort_keys=True, indent=2,
+                                  ensure_ascii=False).encode('utf-8')
+        with open(filename, 'wb') as file:
+            file.write(contents)
     except Exception:
         logger.error(f'Tried to write {filename} but could not.')
         # FIXME Can this be improved?
         return False
 
+    # the local fields only save time, so failing to write them isn't an error
+    try:
+        os.makedirs(os.path.dirname(local_filename) or '.', exist_ok=True)
+        with open(local_filename, 'wb') as file:
+            file.write(json.dumps(local, ensure_ascii=False).encode('utf-8'))
+    except Exception:
+        logger.debug(f'Could not write {local_filename}.', exc_info=True)
+
     return True
 
 
-def get_browser_with_cookies():
+class UploadMapWriter:
+    """
+    Writes the upload map to file after every few successful uploads,
+    or when some time has passed since the last write, instead of after
+    every upload. Progress is kept if a run is interrupted, without
+    serializing the whole map over and over.
+
+    Arguments:
+        upload_map: upload map to write
+        every: number of changes after which the map is written
+        interval: seconds after which a changed map is written
+        filename: file to write to
+    """
+
+    def __init__(self, upload_map, every=50, interval=30, filename='upload_map.json'):
+        self.upload_map = upload_map
+        self.every = every
+        self.interval = interval
+        self.filename = filename
+        self.changes = 0
+        self.last_write = time.monotonic()
+
+    def changed(self):
+        """ Records a change, and writes the upload map if it is due. """
+        self.changes += 1
+        if self.changes >= self.every or time.monotonic() - self.last_write >= self.interval:
+            self.write()
+
+    def write(self):
+        """ Writes the upload map now. """
+        self.changes = 0
+        self.last_write = time.monotonic()
+        return write_upload_map(self.upload_map, self.filename)
+
+
+def load_json(filename):
+    """
+    Loads a JSON file.
+
+    Arguments:
+        filename: path to the JSON file
+
+    Returns:
+        Parsed contents of the file, None if the file is empty
+    """
+
+    with open(filename, 'rb') as file:
+        contents = file.read()
+
+    if not contents.strip():
+        return None
+
+    if orjson is not None:
+        return orjson.loads(contents)
+    return json.loads(contents.decode('utf-8'))
+
+
+def load_yaml(filename):
+    """
+    Loads a YAML file, using the LibYAML bindings if available.
+
+    Arguments:
+        filename: path to the YAML file
+
+    Returns:
+        Parsed contents of the file
+    """
+
+    with open(filename, 'r') as file:
+        return yaml.load(file, Loader=SafeLoader)
+
+
+def get_browser_with_cookies(pool_size=8):
     """
     Creates a mechanicalsoup.StatefulBrowser() instance
     with cookies loaded from file, if exists.
 
+    Connections to iGEM are kept alive and reused, and requests
+    that fail because of connection problems or temporary server errors
+    are retried. Form submissions (POST) are never retried,
+    so that nothing is uploaded twice.
+
+    Arguments:
+        pool_size: number of connections kept open to each server
+
     Returns:
         browser: mechanicalsoup.StatefulBrowser() instance
         cookiejar: browser cookiejar that can be saved after logging in
@@ -201,9 +445,46 @@ def get_browser_with_cookies():
     # ? error handling here?
     browser.set_cookiejar(cookiejar)
 
+    # connection errors are retried only once, without waiting,
+    # so that WikiSync fails straight away when there is no network
+    retries = Retry(total=5, connect=1, backoff_factor=0.5, status_forcelist=(502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+    browser.session.mount('https://', adapter)
+    browser.session.mount('http://', adapter)
+
     return browser, cookiejar
 
 
+# each upload thread gets its own browser, since
+# StatefulBrowser keeps track of the currently selected form
+_thread_data = threading.local()
+
+
+def get_thread_browser(browser):
+    """
+    Returns a mechanicalsoup.StatefulBrowser() instance for the
+    current thread, sharing cookies with the given browser
+    so that the login session is reused. Its connection pools
+    are shared as well, so that connections are reused across threads.
+
+    Arguments:
+        browser: mechanicalsoup.StatefulBrowser instance that has logged in
+
+    Returns:
+        browser: mechanicalsoup.StatefulBrowser() instance for this thread
+    """
+
+    thread_browser = getattr(_thread_data, 'browser', None)
+    if thread_browser is None:
+        thread_browser = mechanicalsoup.StatefulBrowser()
+        thread_browser.set_cookiejar(browser.session.cookies)
+        for prefix in ['https://', 'http://']:
+            thread_browser.session.mount(prefix, browser.session.get_adapter(prefix))
+        _thread_data.browser = thread_browser
+
+    return thread_browser
+
+
 def cache_files(upload_map, config):
     """
     Loads filenames into memory, along with setting up
@@ -225,79 +506,221 @@ def cache_files(upload_map, config):
     }
 
     # for each file in src_dir
-    for root, _, files in os.walk(config['src_dir']):
-        for filename in files:
-
-            # Store path and extension
-            infile = (Path(root) / Path(filename)).relative_to(config['src_dir'])
-            extension = infile.suffix[1:].lower()
-
-            # create appropriate file object
-            # file objects contain corresponding paths and 
-            if extension in ['html', 'css', 'js']:
-                
-                file_object = None
-                if extension == 'html':
-                    file_object = HTMLfile(infile, config)
-
-                elif extension == 'css':
-                    file_object = CSSfile(infile, config)
-
-                elif extension == 'js':
-                    file_object = JSfile(infile, config)
-
-                # In poster mode, make sure URL starts with /Poster after team
-                if config['poster_mode']:
-                    link_URL = file_object.link_URL
-                    after_team = link_URL.split(config['team'])[1]
-                    if len(after_team) < 7 or after_team[0:7] != "/Poster":
-                        message = 'All files must start with /Poster in poster mode.'
-                        logger.debug(message, exc_info=True)
-                        logger.critical(message)
-                        raise Exception
-            
-                cache[extension][file_object.path] = file_object
-
-            elif extension.lower() in ['png', 'gif', 'jpg', 'jpeg', 'pdf', 'ppt', 'txt',
-                                       'zip', 'mp3', 'mp4', 'webm', 'mov', 'swf', 'xls',
-                                       'xlsx', 'docx', 'pptx', 'csv', 'm', 'ogg', 'gb',
-                                       'tif', 'tiff', 'fcs', 'otf', 'eot', 'ttf', 'woff', 'svg']:
-
-                # make sure file path start with 'assets'
-                if len(str(infile)) < 7 or infile.parts[0] != 'assets':
-                    logger.error(f'{infile} is an {extension} file outside the "assets" folder. Skipping.')
-                    continue
+    for entry, infile in walk_files(config['src_dir']):
+
+        # Store extension, without creating a Path for every file
+        stem, _, extension = entry.name.rpartition('.')
+        extension = extension.lower() if stem else ''
+
+        # create appropriate file object
+        # file objects contain corresponding paths and URLs
+        file_object = _make_file(infile, extension, config, entry)
+        if file_object is None:
+            continue
+
+        key = _CACHE_KEY[type(file_object)]
+        cache[key][file_object.path] = file_object
+
+        if key == 'other':
+            continue
+
+        # In poster mode, make sure URL starts with /Poster after team
+        if config['poster_mode']:
+            link_URL = file_object.link_URL
+            after_team = link_URL.split(config['team'])[1]
+            if len(after_team) < 7 or after_team[0:7] != "/Poster":
+                message = 'All files must start with /Poster in poster mode.'
+                logger.debug(message, exc_info=True)
+                logger.critical(message)
+                raise Exception
 
-                # make sure file size is within limits
-                elif (config['src_dir'] / infile).stat().st_size >= 100000000:
-                    logger.error(f'{infile} is larger than the 100MB file limit. Skipping.')
-                    continue
-                # create OtherFile
-                else:
-                    file_object = OtherFile(infile, config)
+        # code files are stored under their extension in the upload map,
+        # keyed by the relative path the walker already built
+        if infile not in upload_map[key]:
+            upload_map[key][infile] = {
+                'md5': '',
+                'link_URL': file_object.link_URL
+            }
 
-                    if len(file_object.upload_filename) < 240:
-                        cache['other'][file_object.path] = file_object
-                    else:
-                        logger.error(f'{infile}: Upload filename too large. Skipping.')
-                        logger.error('Please do not nest assets too deep and take a look at our docs to see how WikiSync renames files.')
-                        continue
+    # only hash files that might have changed since they were uploaded
+    hash_files([file_object for file_object in cache['other'].values()
+                if not is_unchanged(file_object, upload_map['assets'].get(str(file_object.path)))])
 
-            else:
-                logger.error(f'{infile} has an unsupported file extension. Skipping.')
-                continue
+    return cache
 
-            if extension in ['html', 'css', 'js']:
-                if str(file_object.path) not in upload_map[extension].keys():
-                    upload_map[extension][str(file_object.path)] = {
-                        'md5': '',
-                        'link_URL': file_object.link_URL
-                    }
 
-    return cache
+def walk_files(src_dir, workers=32):
+    """
+    Finds all files in a directory and its subdirectories
+    using os.scandir(), which avoids an extra stat() per file.
+
+    Directories are read by several threads at once, since reading
+    a directory mostly waits on the filesystem. This matters most
+    when src_dir is on a network drive.
+    Files are yielded in no particular order.
+
+    Arguments:
+        src_dir: directory to search
+        workers: number of threads reading directories
+
+    Yields:
+        entry: os.DirEntry for each file
+        path: path of the file relative to src_dir
+    """
+
+    # directories waiting to be read, and the number being read right now.
+    # The walk is over when both are empty
+    pending = deque([(src_dir, '')])
+    reading = [0]
+    condition = threading.Condition()
+
+    # lists of files found in each directory,
+    # and a None from each thread once it's done
+    results = queue.Queue()
+
+    def read_directories():
+        try:
+            while True:
+                with condition:
+                    while not pending and reading[0]:
+                        condition.wait()
+                    if not pending:
+                        return
+                    directory, relative = pending.pop()
+                    reading[0] += 1
+
+                subdirectories = []
+                try:
+                    results.put(list(scan(directory, relative, subdirectories)))
+                finally:
+                    with condition:
+                        pending.extend(subdirectories)
+                        reading[0] -= 1
+                        condition.notify_all()
+        finally:
+            results.put(None)
+
+    def scan(directory, relative, subdirectories):
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    path = os.path.join(relative, entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append((entry.path, path))
+                    elif entry.is_file():
+                        # stat here, in parallel; DirEntry caches the result
+                        try:
+                            entry.stat()
+                        except OSError:
+                            continue
+                        yield entry, path
+        # unreadable directories are skipped, like os.walk() does
+        except OSError:
+            logger.debug(f'Could not read {directory}. Skipping.', exc_info=True)
+
+    for _ in range(workers):
+        threading.Thread(target=read_directories, daemon=True).start()
+
+    # file objects are created on the calling thread
+    running = workers
+    while running:
+        files = results.get()
+        if files is None:
+            running -= 1
+        else:
+            yield from files
+
+
+def _make_file(infile, extension, config, entry):
+    """
+    Creates the appropriate file object for a file in src_dir.
+
+    Arguments:
+        infile: path of the file relative to src_dir
+        extension: lowercase file extension
+        config: configuration for this run
+        entry: os.DirEntry for the file
+
+    Returns:
+        HTMLfile, CSSfile, JSfile or OtherFile object.
+        None if the file should be skipped.
+    """
+
+    cls = _EXT_CLASS.get(extension)
+
+    if cls is None:
+        logger.error(f'{infile} has an unsupported file extension. Skipping.')
+        return None
+
+    elif cls is not OtherFile:
+        return cls(infile, config)
+
+    # make sure file path start with 'assets'
+    if len(infile) < 7 or infile.split(os.sep, 1)[0] != 'assets':
+        logger.error(f'{infile} is an {extension} file outside the "assets" folder. Skipping.')
+        return None
+
+    # make sure file size is within limits
+    stat = entry.stat()
+    if stat.st_size >= 100000000:
+        logger.error(f'{infile} is larger than the 100MB file limit. Skipping.')
+        return None
+
+    # create OtherFile
+    file_object = OtherFile(infile, config, stat)
 
+    if len(file_object.upload_filename) >= 240:
+        logger.error(f'{infile}: Upload filename too large. Skipping.')
+        logger.error('Please do not nest assets too deep and take a look at our docs to see how WikiSync renames files.')
+        return None
 
-def upload_and_write_assets(other_files, browser, upload_map, config):
+    return file_object
+
+
+def is_unchanged(file_object, asset):
+    """
+    Checks whether an asset has been modified since it was uploaded,
+    using its modification time and size so that it doesn't have to be hashed.
+
+    Arguments:
+        file_object: OtherFile object
+        asset: entry for this file in the upload map, None if there isn't one
+
+    Returns:
+        True if the file has the same modification time and size as when it was uploaded.
+    """
+
+    return asset is not None and \
+        asset.get('mtime_ns') == file_object.mtime_ns and \
+        asset.get('size') == file_object.size
+
+
+def hash_files(file_objects):
+    """
+    Computes the MD5 hashes of OtherFile objects
+    using all available CPU cores.
+
+    Arguments:
+        file_objects: list of OtherFile objects
+    """
+
+    paths = [str(file_object.src_path) for file_object in file_objects]
+    hash_md5 = partial(hash_file, 'md5')
+
+    # starting threads is only worth it for several files.
+    # hashlib releases the GIL while hashing, so threads run in parallel
+    if len(paths) < 2:
+        hashes = map(hash_md5, paths)
+    else:
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            hashes = list(executor.map(hash_md5, paths))
+
+    path_to_hash = dict(zip(paths, hashes))
+    for file_object in file_objects:
+        file_object.set_md5_hash(path_to_hash[str(file_object.src_path)])
+
+
+def upload_and_write_assets(other_files, browser, upload_map, config, map_writer=None):
     """"
     Uploads and writes all files and stores URLs in upload_map.
 
@@ -306,6 +729,7 @@ def upload_and_write_assets(other_files, browser, upload_map, config):
         browser: mechanicalsoup.StatefulBrowser instance
         upload_map: custom upload map
         config: custom configuration options
+        map_writer: UploadMapWriter that saves progress, optional
 
     Returns:
         Number of files uploaded
@@ -317,76 +741,179 @@ def upload_and_write_assets(other_files, browser, upload_map, config):
     # count the number of files uploaded
     counter = 0
 
+    # files that are new or have changed since the last run
+    changed_files = []
+
     # files have to be uploaded before everything else because
     # the URLs iGEM assigns are random
-    for path in other_files.keys():
-        file_object = other_files[path]
-
-        # flag to see if file has already been uploaded
-        uploaded = False
+    for path, file_object in other_files.items():
 
         # check if the file has already been uploaded
-        for asset_path in upload_map['assets'].keys():
-
-            # if current path matches stored path
-            if asset_path == str(path):
-                asset = upload_map['assets'][asset_path]
-                # and the md5 hash is also the same
-                if file_object.md5_hash == asset['md5']:
-                    # the file has already been uploaded
-                    uploaded = True
-                    break
-                else:
-                    # the file path matches, but the md5 hash doesn't
-                    # this means the file has changed
-                    uploaded = False
-                    break
+        asset = upload_map['assets'].get(str(path))
 
         # if new file
-        if not uploaded:
-            # write to build_dir
-            try:
-                # create directory if doesn't exist
-                if not os.path.isdir(file_object.build_path.parent):
-                    os.makedirs(file_object.build_path.parent)
-                shutil.copyfile(file_object.src_path, file_object.build_path.parent / file_object.upload_filename)
-            except Exception:
-                # print upload map to save the current state
-                write_upload_map(upload_map)
-                message = f'Failed to write {str(file_object.path)} to build_dir. ' + \
-                    'The current upload map has been saved. ' + \
-                    'You will not have to upload everything again.'
-                logger.debug(message, exc_info=True)
-                logger.critical(message)
-                sys.exit(4)
-
-            successful = iGEM_upload_file(browser, file_object, config['year'])
-            if not successful:
-                # print upload map to save the current state
-                write_upload_map(upload_map)
-                message = f'Failed to upload {str(file_object.path)}. '
-                message += 'The current upload map has been saved. '
-                message += 'You will not have to upload everything again.'
-                logger.debug(message, exc_info=True)
-                logger.critical(message)
-                sys.exit(4)
-            else:
+        if asset is None:
+            changed_files.append(file_object)
+
+        # if the file hasn't been touched since it was uploaded
+        elif is_unchanged(file_object, asset):
+            continue
+
+        # if it was touched but the md5 hash is still the same
+        elif file_object.md5_hash == asset['md5']:
+            # remember when it was modified for the next run
+            asset['mtime_ns'] = file_object.mtime_ns
+            asset['size'] = file_object.size
+
+        # the file path matches, but the md5 hash doesn't
+        # this means the file has changed
+        else:
+            changed_files.append(file_object)
+
+    # uploads are limited by network latency, not by the CPU,
+    # so several of them are run simultaneously
+    with ThreadPoolExecutor(max_workers=config['concurrency']) as executor:
+        futures = [executor.submit(_upload_asset, file_object, browser, config)
+                   for file_object in changed_files]
+
+        # first error, if any upload fails
+        failure = None
+
+        # upload_map is only modified here, on the main thread
+        try:
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+
+                file_object, error = future.result()
+
+                if error is not None:
+                    if failure is None:
+                        failure = error
+                        # don't start any uploads that are still waiting,
+                        # but keep recording the ones that are already running
+                        for pending in futures:
+                            pending.cancel()
+                    else:
+                        logger.error(error)
+                    continue
+
                 counter += 1
+                _record_asset(upload_map, file_object)
+
+                if map_writer is not None:
+                    map_writer.changed()
+
+        # on Ctrl-C, record everything that was uploaded before stopping
+        except BaseException:
+            _stop_uploads(executor, futures)
+            for future in futures:
+                if not future.cancelled():
+                    file_object, error = future.result()
+                    if error is None:
+                        _record_asset(upload_map, file_object)
+            raise
+
+    if failure is not None:
+        # print upload map to save the current state
+        if map_writer is not None:
+            map_writer.write()
+        else:
+            write_upload_map(upload_map)
+        message = failure + 'The current upload map has been saved. ' + \
+            'You will not have to upload everything again.'
+        logger.critical(message)
+        sys.exit(4)
 
-            if str(path) in upload_map['assets'].keys():
-                upload_map['assets'][str(path)]['md5'] = file_object.md5_hash
-                upload_map['assets'][str(path)]['link_URL'] = file_object.link_URL
-            else:
-                upload_map['assets'][str(path)] = {
-                    'link_URL': file_object.link_URL,
-                    'md5': file_object.md5_hash,
-                    'upload_filename': file_object.upload_filename
-                }
+    # the URLs iGEM assigned can't be found again if the run is killed
+    # while code is being processed, so they are saved right away
+    if map_writer is not None and map_writer.changes > 0:
+        map_writer.write()
 
     return counter
 
 
-def build_and_upload(files, browser, config, upload_map):
+def _record_asset(upload_map, file_object):
+    """
+    Stores the URL and hash of an uploaded asset in upload_map.
+
+    Arguments:
+        upload_map: custom upload map
+        file_object: OtherFile object that has been uploaded
+    """
+
+    path = str(file_object.path)
+    asset = upload_map['assets'].get(path)
+    if asset is not None:
+        asset['md5'] = file_object.md5_hash
+        asset['link_URL'] = file_object.link_URL
+        asset['mtime_ns'] = file_object.mtime_ns
+        asset['size'] = file_object.size
+    else:
+        upload_map['assets'][path] = {
+            'link_URL': file_object.link_URL,
+            'md5': file_object.md5_hash,
+            'mtime_ns': file_object.mtime_ns,
+            'size': file_object.size,
+            'upload_filename': file_object.upload_filename
+        }
+
+
+def _stop_uploads(executor, futures):
+    """
+    Cancels uploads that haven't started yet
+    and waits for the ones that are running.
+
+    Arguments:
+        executor: ThreadPoolExecutor running the uploads
+        futures: futures of all uploads
+    """
+
+    for future in futures:
+        future.cancel()
+    executor.shutdown(wait=True)
+
+
+def _upload_asset(file_object, browser, config):
+    """
+    Writes a single asset to build_dir and uploads it.
+    Runs on a worker thread.
+
+    Arguments:
+        file_object: OtherFile object
+        browser: mechanicalsoup.StatefulBrowser instance that has logged in
+        config: custom configuration options
+
+    Returns:
+        file_object: the same OtherFile object, with link_URL set
+        error: message describing what went wrong, None if successful
+    """
+
+    # write to build_dir
+    try:
+        # create directory if doesn't exist
+        os.makedirs(file_object.build_path.parent, exist_ok=True)
+        shutil.copyfile(file_object.src_path, file_object.build_path.parent / file_object.upload_filename)
+    except Exception:
+        message = f'Failed to write {str(file_object.path)} to build_dir. '
+        logger.debug(message, exc_info=True)
+        return file_object, message
+
+    # errors are returned instead of raised, so that
+    # the results of other uploads can still be recorded
+    try:
+        successful = iGEM_upload_file(get_thread_browser(browser), file_object, config['year'])
+    except Exception:
+        successful = False
+    if not successful:
+        message = f'Failed to upload {str(file_object.path)}. '
+        logger.debug(message, exc_info=True)
+        return file_object, message
+
+    return file_object, None
+
+
+def build_and_upload(files, browser, config, upload_map, map_writer=None):
     """
     Replaces URLs in files and uploads changed files.
 
@@ -395,6 +922,7 @@ def build_and_upload(files, browser, config, upload_map):
         browser: mechanicalsoup.StatefulBrowser instance
         config: Configuration for this run
         upload_map: custom upload map
+        map_writer: UploadMapWriter that saves progress, optional
 
     Returns:
         Dictionary with no. of 'html', 'css' and 'js' files uploaded
@@ -406,67 +934,411 @@ def build_and_upload(files, browser, config, upload_map):
         'js': 0,
     }
 
+    # files that have to be processed, along with the
+    # information required to write and upload them afterwards
+    pending = []
+
+    # files that have already been processed in a previous run
+    cached = []
+
+    # the asset URLs don't change while code is being processed
+    assets_signature = get_assets_signature(upload_map, config)
+
     for file_dictionary in [files['html'], files['css'], files['js']]:
-        for path in file_dictionary.keys():
-            file_object = file_dictionary[path]
+        for file_object in file_dictionary.values():
             path_str = str(file_object.path)
             ext = file_object.extension
+            entry = upload_map[ext][path_str]
+
+            # skip without reading the file if neither the file
+            # nor the asset URLs have changed since it was uploaded
+            try:
+                src_mtime_ns = file_object.src_path.stat().st_mtime_ns
+            except Exception:
+                src_mtime_ns = None
+            if src_mtime_ns is not None and \
+                    entry.get('src_mtime_ns') == src_mtime_ns and \
+                    entry.get('assets_signature') == assets_signature:
+                logger.info(f'{file_object.path} has not changed since it was uploaded. Skipping.')
+                continue
 
-            # open file
+            # read the whole file at once and decode it only once
             try:
-                with open(file_object.src_path, 'r') as file:
-                    contents = file.read()
+                source = file_object.src_path.read_bytes()
+                contents = source.decode('utf-8')
             except Exception:
                 message = f'Could not open/read {file_object.path}. Skipping.'
                 logger.error(message)
                 continue  # FIXME Can this be improved?
 
-            processed = None  # just so the linter doesn't freak out
-            # parse and modify contents
-            if ext == 'html':
-                processed = HTMLparser(
-                    config, file_object.path, contents, upload_map)
-            elif ext == 'css':
-                processed = CSSparser(
-                    config, file_object.path, contents, upload_map)
-            elif ext == 'js':
-                processed = JSparser(contents)
+            # translate newlines like text mode does, so that
+            # files with Windows line endings get the same hashes as before
+            if '\r' in contents:
+                contents = contents.replace('\r\n', '\n').replace('\r', '\n')
+
+            # processed contents depend on the source and the asset URLs
+            cache_key = f'{hashlib.sha1(source).hexdigest()}-{assets_signature}'
+
+            # reuse the processed contents from a previous run if possible
+            processed = read_build_cache(path_str, cache_key)
+
+            if processed is None:
+                pending.append((file_object, src_mtime_ns, cache_key, contents))
+            else:
+                logger.info(f'Using previously processed contents of {file_object.path}.')
+                cached.append((file_object, src_mtime_ns, processed))
+
+    # parse and modify contents using all CPU cores
+    tasks = [(file_object.extension, file_object.path, contents)
+             for file_object, _, _, contents in pending]
+    parsed = parse_files(tasks, config, upload_map)
+
+    # upload simultaneously, since uploads are limited by network latency
+    with ThreadPoolExecutor(max_workers=config['concurrency']) as executor:
+        futures = {}
+
+        def prepare(file_object, src_mtime_ns, processed):
+            """ Writes processed contents to build_dir and starts uploading them if they have changed. """
+
+            entry = upload_map[file_object.extension][str(file_object.path)]
+
+            # encode once, and use the same bytes for hashing and writing
+            encoded = processed.encode('utf-8')
 
             # calculate and store md5 hash of the modified contents
-            build_hash = md5(processed.encode('utf-8')).hexdigest()
+            build_hash = md5(encoded).hexdigest()
 
-            if upload_map[ext][path_str]['md5'] == build_hash:
+            if entry['md5'] == build_hash:
                 message = f'Contents of {file_object.path} have been uploaded previously. Skipping.'
                 logger.info(message)
-            else:
-                upload_map[ext][path_str]['md5'] = build_hash
-                build_path = file_object.build_path
-                try:
-                    # create directory if doesn't exist
-                    if not os.path.isdir(build_path.parent):
-                        os.makedirs(build_path.parent)
-                    # and write the processed contents
-                    with open(build_path, 'w') as file:
-                        file.write(processed)
-                except Exception:
-                    message = f"Couldn not write {str(file_object.build_path)}. Skipping."
-                    logger.error(message)
-                    continue
-                    # FIXME Can this be improved?
+                # so that the file doesn't have to be read next time
+                entry['src_mtime_ns'] = src_mtime_ns
+                entry['assets_signature'] = assets_signature
+                return
 
-                # upload
-                successful = iGEM_upload_page(browser, processed, file_object.upload_URL)
-                if not successful:
+            build_path = file_object.build_path
+            try:
+                # create directory if doesn't exist
+                if not os.path.isdir(build_path.parent):
+                    os.makedirs(build_path.parent)
+                # and write the processed contents
+                with open(build_path, 'wb') as file:
+                    file.write(encoded)
+            except Exception:
+                message = f"Couldn not write {str(file_object.build_path)}. Skipping."
+                logger.error(message)
+                return
+                # FIXME Can this be improved?
+
+            future = executor.submit(_upload_page, browser, processed, file_object.upload_URL)
+            futures[future] = (file_object, build_hash, src_mtime_ns)
+
+        def record(future):
+            """ Stores the hash of an uploaded file in upload_map. """
+
+            # store the hash only once the upload has succeeded
+            # so that failed uploads are retried on the next run
+            file_object, build_hash, src_mtime_ns = futures[future]
+            entry = upload_map[file_object.extension][str(file_object.path)]
+            entry['md5'] = build_hash
+            entry['src_mtime_ns'] = src_mtime_ns
+            entry['assets_signature'] = assets_signature
+
+        try:
+            # files are uploaded while the rest are still being parsed.
+            # Parsing starts first, so that worker processes
+            # are started before any upload threads
+            for (file_object, src_mtime_ns, cache_key, _), processed in zip(pending, parsed):
+                write_build_cache(str(file_object.path), cache_key, processed)
+                prepare(file_object, src_mtime_ns, processed)
+
+            for file_object, src_mtime_ns, processed in cached:
+                prepare(file_object, src_mtime_ns, processed)
+
+            # upload_map is only modified here, on the main thread
+            for future in as_completed(futures):
+                file_object = futures[future][0]
+                if not future.result():
                     message = f'Could not upload {str(file_object.path)}. Skipping.'
                     logger.error(message)
                     continue
                     # FIXME Can this be improved?
-                else:
-                    counter[ext] += 1
+
+                record(future)
+                counter[file_object.extension] += 1
+
+                if map_writer is not None:
+                    map_writer.changed()
+
+        # on Ctrl-C, record everything that was uploaded before stopping
+        except BaseException:
+            parsed.close()
+            _stop_uploads(executor, futures)
+            for future in futures:
+                if not future.cancelled() and future.result():
+                    record(future)
+            raise
+
+    # forget processed contents of files that have been deleted
+    prune_build_cache([str(path) for file_dictionary in [files['html'], files['css'], files['js']]
+                       for path in file_dictionary])
 
     return counter
 
 
+def parse_code(ext, config, path, contents, upload_map):
+    """
+    Replaces URLs in the contents of an HTML, CSS or JS file.
+
+    Arguments:
+        ext: 'html', 'css' or 'js'
+        config: Configuration for this run
+        path: path to the file
+        contents: contents of the file
+        upload_map: custom upload map
+
+    Returns:
+        Contents with replaced URLs
+    """
+
+    if ext == 'html':
+        return HTMLparser(config, path, contents, upload_map)
+    elif ext == 'css':
+        return CSSparser(config, path, contents, upload_map)
+    elif ext == 'js':
+        return JSparser(contents)
+
+
+def parse_files(tasks, config, upload_map):
+    """
+    Parses code files in worker processes, since parsing
+    is limited by the CPU and threads would be limited by the GIL.
+    Log messages from the workers are passed on to the main process.
+
+    Worker processes are only used where they can be forked.
+    Processes started any other way import the calling script again,
+    and would run it all over again if it isn't guarded by
+    if __name__ == '__main__'. Files are parsed one by one otherwise.
+
+    Arguments:
+        tasks: list of (extension, path, contents) tuples
+        config: Configuration for this run
+        upload_map: custom upload map
+
+    Yields:
+        Processed contents of each file, in the same order as tasks
+    """
+
+    def parse_serially(tasks):
+        for ext, path, contents in tasks:
+            yield parse_code(ext, config, path, contents, upload_map)
+
+    # starting worker processes is only worth it for several files,
+    # and worker initializers need Python 3.7+
+    if len(tasks) < 2 or sys.version_info < (3, 7) or not _can_fork():
+        yield from parse_serially(tasks)
+        return
+
+    context = multiprocessing.get_context('fork')
+
+    # the parsers only need the URLs, which keeps
+    # the data sent to each worker process small
+    link_map = {
+        filetype: {path: {'link_URL': entry.get('link_URL')} for path, entry in entries.items()}
+        for filetype, entries in upload_map.items()
+    }
+
+    log_queue = context.Queue()
+    listener = QueueListener(log_queue, *logger.handlers, respect_handler_level=True)
+
+    done = 0
+    listening = False
+    try:
+        with ProcessPoolExecutor(mp_context=context, initializer=_init_parse_worker,
+                                 initargs=(log_queue, config, link_map)) as executor:
+            results = executor.map(_parse_in_worker, tasks, chunksize=4)
+            # start listening only after the workers have been started,
+            # so that no threads are running when they are forked
+            listener.start()
+            listening = True
+            for processed in results:
+                yield processed
+                done += 1
+    except BrokenProcessPool:
+        # a worker process died, for example because it ran out of memory
+        logger.debug('Could not parse files in parallel. Parsing them one by one.', exc_info=True)
+        yield from parse_serially(tasks[done:])
+    finally:
+        if listening:
+            listener.stop()
+
+
+def _can_fork():
+    """
+    Returns whether worker processes can be forked safely.
+    fork is not available on Windows, and macOS system
+    libraries may crash in forked processes.
+    """
+    return sys.platform != 'darwin' and 'fork' in multiprocessing.get_all_start_methods()
+
+
+# data shared by all tasks in a parsing worker process
+_worker_data = {}
+
+
+def _init_parse_worker(log_queue, config, upload_map):
+    """ Sets up a worker process started by parse_files(). """
+
+    # send log messages to the main process,
+    # which writes them to the console and to the log file
+    logger.handlers = [QueueHandler(log_queue)]
+
+    _worker_data['config'] = config
+    _worker_data['upload_map'] = upload_map
+
+
+def _parse_in_worker(task):
+    """ Parses a single file in a worker process. """
+
+    ext, path, contents = task
+    return parse_code(ext, _worker_data['config'], path, contents, _worker_data['upload_map'])
+
+
+def get_assets_signature(upload_map, config):
+    """
+    Returns a short hash of everything other than the source
+    that affects how code files are processed: the URLs of uploaded
+    assets and the team, year and poster mode settings.
+
+    Arguments:
+        upload_map: custom upload map
+        config: configuration for this run
+
+    Returns:
+        Hex string that changes whenever processed code might change
+    """
+
+    signature = {
+        'assets': {path: asset.get('link_URL') for path, asset in upload_map['assets'].items()},
+        'team': config['team'],
+        'year': config['year'],
+        'poster_mode': config['poster_mode']
+    }
+
+    return hashlib.sha1(json.dumps(signature, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def _build_cache_filename(path, cache_dir):
+    """ Returns the file where processed contents of a source file are stored. """
+    return os.path.join(cache_dir, hashlib.sha1(path.encode('utf-8')).hexdigest())
+
+
+def read_build_cache(path, key, cache_dir=BUILD_CACHE_DIR):
+    """
+    Returns previously processed contents of a code file.
+
+    Arguments:
+        path: path of the source file relative to src_dir
+        key: cache key of the current contents of the source file
+        cache_dir: directory where processed contents are stored
+
+    Returns:
+        Processed contents, None if they haven't been cached
+        or were cached for different contents.
+    """
+
+    try:
+        with open(_build_cache_filename(path, cache_dir), 'rb') as file:
+            # the key is stored on the first line, so that
+            # outdated contents don't have to be read
+            if file.readline().rstrip(b'\n').decode('utf-8') != key:
+                return None
+            return file.read().decode('utf-8')
+    except Exception:
+        return None
+
+
+def write_build_cache(path, key, processed, cache_dir=BUILD_CACHE_DIR):
+    """
+    Stores the processed contents of a code file for later runs.
+    Only the latest contents of each file are kept.
+
+    Arguments:
+        path: path of the source file relative to src_dir
+        key: cache key of the current contents of the source file
+        processed: processed contents
+        cache_dir: directory where processed contents are stored
+
+    Returns:
+        True if the contents were stored, False otherwise.
+    """
+
+    filename = _build_cache_filename(path, cache_dir)
+    temp_filename = filename + '.tmp'
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(temp_filename, 'wb') as file:
+            file.write(key.encode('utf-8') + b'\n')
+            file.write(processed.encode('utf-8'))
+        # replace atomically so that a crash never leaves a half written file
+        os.replace(temp_filename, filename)
+    except Exception:
+        logger.debug(f'Could not write {filename}.', exc_info=True)
+        return False
+
+    return True
+
+
+def prune_build_cache(paths, cache_dir=BUILD_CACHE_DIR):
+    """
+    Removes processed contents of files that no longer exist.
+
+    Arguments:
+        paths: paths of all current source files relative to src_dir
+        cache_dir: directory where processed contents are stored
+    """
+
+    keep = {_build_cache_filename(path, cache_dir) for path in paths}
+    keep.add(os.path.join(cache_dir, os.path.basename(LOCAL_UPLOAD_MAP)))
+
+    try:
+        with os.scandir(cache_dir) as entries:
+            filenames = [entry.path for entry in entries]
+    except OSError:
+        return
+
+    for filename in filenames:
+        if filename not in keep:
+            try:
+                os.remove(filename)
+            except OSError:
+                logger.debug(f'Could not remove {filename}.', exc_info=True)
+
+
+def _upload_page(browser, contents, url):
+    """
+    Uploads source code using the browser of the current thread.
+    Runs on a worker thread.
+
+    Arguments:
+        browser: mechanicalsoup.StatefulBrowser instance that has logged in
+        contents: source code to be uploaded
+        url: the page where source code will uploaded
+
+    Returns:
+        True if successful, False otherwise.
+    """
+
+    # errors are returned instead of raised, so that
+    # the results of other uploads can still be recorded
+    try:
+        return iGEM_upload_page(get_thread_browser(browser), contents, url)
+    except Exception:
+        logger.debug(f'Failed to upload {url}.', exc_info=True)
+        return False
+
+
 def print_summary(assets, code):
 
     total_count = assets + code['html'] + code['css'] + code['js']
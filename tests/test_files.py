@@ -75,3 +75,13 @@ def test_OtherFile(config):
     url = 'hello'
     other_file.set_link_URL(url)
     assert str(other_file.link_URL) == 'hello'
+
+
+def test_lazy_attributes(config):
+    html_file = HTMLfile('Test/index.html', config)
+
+    # URLs are only generated when they are used
+    assert 'link_URL' not in vars(html_file)
+    link_URL = html_file.link_URL
+    assert 'link_URL' in vars(html_file)
+    assert html_file.link_URL is link_URL
@@ -1,10 +1,22 @@
+import hashlib
+import json
 import os
 import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
 import pytest
 import yaml
 
-from igem_wikisync.wikisync import get_upload_map, run, write_upload_map
+from igem_wikisync import wikisync
+from igem_wikisync.files import OtherFile
+from igem_wikisync.wikisync import (UploadMapWriter, build_and_upload, cache_files, get_assets_signature,
+                                    get_browser_with_cookies, get_thread_browser, get_upload_map, hash_files,
+                                    is_unchanged, load_yaml, parse_code, parse_files, prune_build_cache,
+                                    read_build_cache, run, upload_and_write_assets, walk_files, write_build_cache,
+                                    write_upload_map)
 
 
 @pytest.fixture
@@ -12,7 +24,9 @@ def config():
     return {
         'src_dir': 'tests/data',
         'build_dir': 'tests/build',
-        'team': 'BITSPilani-Goa_India'
+        'team': 'BITSPilani-Goa_India',
+        'year': '2020',
+        'poster_mode': False
     }
 
 
@@ -85,8 +99,400 @@ def test_write_upload_map():
 
     assert write_upload_map(upload_map)
 
-    if os.path.isfile('upload_map.yml'):
-        os.remove('upload_map.yml')
+    with open('upload_map.json', 'r') as file:
+        contents = file.read()
+    assert json.loads(contents) == upload_map
+    # one entry per line, so that diffs stay readable
+    assert '\n    "hello": {\n' in contents
+
+    if os.path.isfile('upload_map.json'):
+        os.remove('upload_map.json')
+
+
+def test_upload_map_local_fields(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    asset = {'link_URL': 'test_link_URL', 'md5': 'test_md5', 'upload_filename': 'T--test.jpg'}
+    upload_map = {'assets': {'assets/test.jpg': dict(asset, mtime_ns=1, size=2)}}
+
+    assert write_upload_map(upload_map)
+
+    # modification times are not shared through version control
+    with open('upload_map.json', 'r') as file:
+        assert json.load(file)['assets']['assets/test.jpg'] == asset
+    assert get_upload_map()['assets'] == upload_map['assets']
+
+    # and are ignored once someone else has uploaded a new version
+    with open('upload_map.json', 'w') as file:
+        json.dump({'assets': {'assets/test.jpg': dict(asset, md5='new_md5')}}, file)
+    assert get_upload_map()['assets']['assets/test.jpg'] == dict(asset, md5='new_md5')
+
+
+def test_upload_map_writer():
+    upload_map = {'assets': {}}
+    map_writer = UploadMapWriter(upload_map, every=2, interval=3600)
+
+    upload_map['assets']['first'] = {'md5': 'first_md5'}
+    map_writer.changed()
+    assert not os.path.isfile('upload_map.json')
+
+    upload_map['assets']['second'] = {'md5': 'second_md5'}
+    map_writer.changed()
+    with open('upload_map.json', 'r') as file:
+        assert json.load(file) == upload_map
+
+    os.remove('upload_map.json')
+
+
+def test_get_upload_map_prefers_json():
+    with open('upload_map.yml', 'w') as file:
+        yaml.safe_dump({'html': {'old': {'link_URL': 'old_link_URL'}}}, file)
+
+    assert write_upload_map({'html': {'new': {'link_URL': 'new_link_URL'}}})
+
+    upload_map = get_upload_map()
+    assert list(upload_map['html'].keys()) == ['new']
+
+    os.remove('upload_map.json')
+    os.remove('upload_map.yml')
+
+
+def test_load_yaml():
+    upload_map = {
+        'html': {
+            'hello': {'link_URL': 'hello_link_URL'}
+        }
+    }
+
+    with open('upload_map.yml', 'w') as file:
+        yaml.safe_dump(upload_map, file)
+
+    assert load_yaml('upload_map.yml') == upload_map
+
+    os.remove('upload_map.yml')
+
+
+def test_walk_files(config):
+    expected = set()
+    for root, _, files in os.walk(config['src_dir']):
+        for filename in files:
+            expected.add(os.path.relpath(os.path.join(root, filename), config['src_dir']))
+
+    found = {}
+    for entry, path in walk_files(config['src_dir']):
+        found[path] = entry
+
+    assert set(found.keys()) == expected
+    for path, entry in found.items():
+        assert entry.path == os.path.join(config['src_dir'], path)
+
+
+def test_hash_files(config):
+    paths = ['assets/img/test.jpg', 'assets/img/test-test.jpg', 'assets/img/another-test.jpg']
+    file_objects = [OtherFile(path, config) for path in paths]
+
+    hash_files(file_objects)
+
+    for file_object in file_objects:
+        with open(file_object.src_path, 'rb') as file:
+            assert file_object.md5_hash == hashlib.md5(file.read()).hexdigest()
+
+
+def test_is_unchanged(config):
+    file_object = OtherFile('assets/img/test.jpg', config)
+    stat = os.stat(file_object.src_path)
+
+    assert not is_unchanged(file_object, None)
+    assert not is_unchanged(file_object, {'md5': 'd47d3629a83090c33e94c961e03a03d2'})
+    assert not is_unchanged(file_object, {'mtime_ns': stat.st_mtime_ns - 1, 'size': stat.st_size})
+    assert is_unchanged(file_object, {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size})
+
+
+def test_build_cache(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+
+    assert read_build_cache('index.html', 'key', cache_dir) is None
+    assert write_build_cache('index.html', 'key', '<p>Contents</p>', cache_dir)
+    assert read_build_cache('index.html', 'key', cache_dir) == '<p>Contents</p>'
+    assert read_build_cache('index.html', 'other_key', cache_dir) is None
+
+    # only the latest contents of each file are kept
+    assert write_build_cache('index.html', 'new_key', '<p>New contents</p>', cache_dir)
+    assert write_build_cache('about.html', 'key', '<p>About</p>', cache_dir)
+    assert len(os.listdir(cache_dir)) == 2
+    assert read_build_cache('index.html', 'key', cache_dir) is None
+    assert read_build_cache('index.html', 'new_key', cache_dir) == '<p>New contents</p>'
+
+    # and files that no longer exist are forgotten
+    prune_build_cache(['index.html'], cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+    assert read_build_cache('index.html', 'new_key', cache_dir) == '<p>New contents</p>'
+
+
+@pytest.fixture
+def build_config(tmp_path, monkeypatch):
+    shutil.copytree('tests/data', str(tmp_path / 'src'))
+    # the upload map and build cache are stored in the current directory
+    monkeypatch.chdir(tmp_path)
+    return {
+        'src_dir': tmp_path / 'src',
+        'build_dir': tmp_path / 'build',
+        'team': 'BITSPilani-Goa_India',
+        'year': '2020',
+        'silence_warnings': False,
+        'poster_mode': False,
+        'concurrency': 4
+    }
+
+
+@pytest.fixture
+def uploaded_pages(monkeypatch):
+    uploaded = {}
+
+    def upload(browser, contents, url):
+        uploaded[url] = contents
+        return True
+
+    monkeypatch.setattr(wikisync, 'iGEM_upload_page', upload)
+    return uploaded
+
+
+def test_build_and_upload(build_config, uploaded_pages, monkeypatch):
+    reads = []
+    monkeypatch.setattr(wikisync, 'read_build_cache',
+                        lambda path, key: reads.append(path) or read_build_cache(path, key))
+
+    upload_map = get_upload_map()
+    upload_map['assets']['assets/img/test.jpg'] = {'link_URL': 'https://2020.igem.org/wiki/images/test.jpg'}
+    browser = get_browser_with_cookies()[0]
+    files = cache_files(upload_map, build_config)
+    code_files = sum(len(files[ext]) for ext in ['html', 'css', 'js'])
+
+    counter = build_and_upload(files, browser, build_config, upload_map)
+    assert sum(counter.values()) == code_files
+    assert len(uploaded_pages) == code_files
+    assert len(reads) == code_files
+
+    assert write_upload_map(upload_map)
+    with open('upload_map.json', 'rb') as file:
+        shared = file.read()
+    assert b'src_mtime_ns' not in shared
+
+    # nothing is read or uploaded if nothing has changed,
+    # and the shared upload map stays the same
+    upload_map = get_upload_map()
+    uploaded_pages.clear()
+    reads.clear()
+    counter = build_and_upload(files, browser, build_config, upload_map)
+    assert sum(counter.values()) == 0
+    assert uploaded_pages == {}
+    assert reads == []
+    assert write_upload_map(upload_map)
+    with open('upload_map.json', 'rb') as file:
+        assert file.read() == shared
+
+    # every file is processed again when an asset URL changes,
+    # but only the ones which use that asset are uploaded
+    new_URL = 'https://2020.igem.org/wiki/images/changed.jpg'
+    upload_map['assets']['assets/img/test.jpg']['link_URL'] = new_URL
+    counter = build_and_upload(files, browser, build_config, upload_map)
+    assert len(reads) == code_files
+    assert sum(counter.values()) == len(uploaded_pages)
+    assert files['html'][Path('Test/html/img.html')].upload_URL in uploaded_pages
+    for contents in uploaded_pages.values():
+        assert new_URL in contents
+
+
+def test_build_and_upload_windows_line_endings(build_config, uploaded_pages):
+    upload_map = get_upload_map()
+    browser = get_browser_with_cookies()[0]
+    files = cache_files(upload_map, build_config)
+    build_and_upload(files, browser, build_config, upload_map)
+
+    # the same file with Windows line endings is not uploaded again
+    path = build_config['src_dir'] / 'Test/css/style.css'
+    contents = path.read_bytes()
+    assert b'\r' not in contents and b'\n' in contents
+    path.write_bytes(contents.replace(b'\n', b'\r\n'))
+    os.utime(str(path), ns=(0, 0))
+
+    uploaded_pages.clear()
+    counter = build_and_upload(files, browser, build_config, upload_map)
+    assert sum(counter.values()) == 0
+    assert uploaded_pages == {}
+
+
+@pytest.mark.parametrize('can_fork', [True, False])
+def test_parse_files(build_config, monkeypatch, can_fork):
+    monkeypatch.setattr(wikisync, '_can_fork', lambda: can_fork)
+
+    upload_map = get_upload_map()
+    files = cache_files(upload_map, build_config)
+    tasks = [(file_object.extension, file_object.path, file_object.src_path.read_text())
+             for ext in ['html', 'css', 'js'] for file_object in files[ext].values()]
+
+    # results are in the same order as the files, however they are parsed
+    expected = [parse_code(ext, build_config, path, contents, upload_map) for ext, path, contents in tasks]
+    assert list(parse_files(tasks, build_config, upload_map)) == expected
+
+
+def test_get_assets_signature(config):
+    upload_map = get_upload_map()
+    upload_map['assets']['assets/img/test.jpg'] = {'link_URL': 'somerandomURLthatiGEMsends', 'md5': 'hash'}
+    signature = get_assets_signature(upload_map, config)
+
+    # only URLs of assets affect processed code
+    upload_map['assets']['assets/img/test.jpg']['md5'] = 'changed hash'
+    assert get_assets_signature(upload_map, config) == signature
+
+    upload_map['assets']['assets/img/test.jpg']['link_URL'] = 'anotherrandomURLthatiGEMsends'
+    assert get_assets_signature(upload_map, config) != signature
+
+
+def test_get_browser_with_cookies():
+    browser, cookiejar = get_browser_with_cookies(pool_size=4)
+
+    assert browser.session.cookies is cookiejar
+
+    adapter = browser.session.get_adapter('https://2020.igem.org')
+    assert adapter is browser.session.get_adapter('http://2020.igem.org')
+    assert adapter.max_retries.total == 5
+    assert adapter.max_retries.connect == 1
+    # uploads must never be retried
+    assert 'POST' not in adapter.max_retries.allowed_methods
+
+
+def test_get_thread_browser():
+    browser, _ = get_browser_with_cookies()
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        thread_browsers = list(executor.map(lambda _: get_thread_browser(browser), range(2)))
+
+    # every thread gets its own browser, but the login session
+    # and the connections are shared
+    for thread_browser in thread_browsers:
+        assert thread_browser is not browser
+        assert thread_browser.session.cookies is browser.session.cookies
+        assert thread_browser.session.get_adapter('https://') is browser.session.get_adapter('https://')
+
+    # the same thread keeps using the same browser
+    assert get_thread_browser(browser) is get_thread_browser(browser)
+
+
+@pytest.mark.parametrize('raises', [False, True])
+def test_upload_and_write_assets_records_running_uploads(config, tmp_path, monkeypatch, raises):
+    config['build_dir'] = tmp_path
+    config['concurrency'] = 4
+    paths = ['assets/img/test.jpg', 'assets/img/test-test.jpg', 'assets/img/another-test.jpg']
+    other_files = {path: OtherFile(path, config) for path in paths}
+    started = threading.Barrier(len(paths))
+    failed = threading.Event()
+
+    def upload(browser, file_object, year):
+        started.wait(5)
+        if str(file_object.path) == 'assets/img/test.jpg':
+            failed.set()
+            if raises:
+                raise AttributeError("'NoneType' object has no attribute 'find'")
+            return False
+        # still running when the failure is handled
+        failed.wait(5)
+        time.sleep(0.2)
+        file_object.set_link_URL('link_' + file_object.upload_filename)
+        return True
+
+    monkeypatch.setattr(wikisync, 'iGEM_upload_file', upload)
+    upload_map = get_upload_map()
+
+    with pytest.raises(SystemExit) as exit_info:
+        upload_and_write_assets(other_files, get_browser_with_cookies()[0], upload_map, config)
+    assert exit_info.value.code == 4
+
+    with open('upload_map.json', 'r') as file:
+        assets = json.load(file)['assets']
+    assert sorted(assets.keys()) == sorted(paths[1:])
+
+    os.remove('upload_map.json')
+
+
+def test_upload_and_write_assets_saves_upload_map(config, tmp_path, monkeypatch):
+    config['build_dir'] = tmp_path
+    config['concurrency'] = 4
+    paths = ['assets/img/test.jpg', 'assets/img/test-test.jpg', 'assets/img/another-test.jpg']
+    other_files = {path: OtherFile(path, config) for path in paths}
+
+    def upload(browser, file_object, year):
+        file_object.set_link_URL('link_' + file_object.upload_filename)
+        return True
+
+    monkeypatch.setattr(wikisync, 'iGEM_upload_file', upload)
+    upload_map = get_upload_map()
+
+    # written once all assets are uploaded, even if fewer than every
+    upload_and_write_assets(other_files, get_browser_with_cookies()[0], upload_map, config,
+                            UploadMapWriter(upload_map, every=50, interval=3600))
+
+    with open('upload_map.json', 'r') as file:
+        assert sorted(json.load(file)['assets'].keys()) == sorted(paths)
+
+    os.remove('upload_map.json')
+
+
+@pytest.fixture
+def interrupt_after_first_upload(monkeypatch):
+    original = wikisync.as_completed
+
+    def as_completed(futures):
+        yield next(original(futures))
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(wikisync, 'as_completed', as_completed)
+
+
+def test_upload_and_write_assets_interrupted(config, tmp_path, monkeypatch, interrupt_after_first_upload):
+    config['build_dir'] = tmp_path
+    config['concurrency'] = 1
+    paths = ['assets/img/test.jpg', 'assets/img/test-test.jpg', 'assets/img/another-test.jpg']
+    other_files = {path: OtherFile(path, config) for path in paths}
+    uploaded = []
+
+    def upload(browser, file_object, year):
+        time.sleep(0.05)
+        file_object.set_link_URL('link_' + file_object.upload_filename)
+        uploaded.append(str(file_object.path))
+        return True
+
+    monkeypatch.setattr(wikisync, 'iGEM_upload_file', upload)
+    upload_map = get_upload_map()
+
+    with pytest.raises(KeyboardInterrupt):
+        upload_and_write_assets(other_files, get_browser_with_cookies()[0], upload_map, config)
+
+    # uploads that haven't started are cancelled,
+    # and every finished upload is recorded
+    assert len(uploaded) < len(paths)
+    assert sorted(upload_map['assets'].keys()) == sorted(uploaded)
+
+
+def test_build_and_upload_interrupted(build_config, uploaded_pages, monkeypatch, interrupt_after_first_upload):
+    upload = wikisync.iGEM_upload_page
+
+    def slow_upload(browser, contents, url):
+        time.sleep(0.05)
+        return upload(browser, contents, url)
+
+    monkeypatch.setattr(wikisync, 'iGEM_upload_page', slow_upload)
+
+    upload_map = get_upload_map()
+    files = cache_files(upload_map, build_config)
+    code_files = [file_object for ext in ['html', 'css', 'js'] for file_object in files[ext].values()]
+
+    with pytest.raises(KeyboardInterrupt):
+        build_and_upload(files, get_browser_with_cookies()[0], build_config, upload_map)
+
+    assert 0 < len(uploaded_pages) < len(code_files)
+    for file_object in code_files:
+        uploaded = file_object.upload_URL in uploaded_pages
+        assert bool(upload_map[file_object.extension][str(file_object.path)]['md5']) == uploaded
 
 
 def test_run(config):